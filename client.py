@@ -1,87 +1,189 @@
-'''
----------------------------------
-Client For Socket Programming
----------------------------------
-__updated__ = '2025-10-20'
-Author: Luke Vrbanac, 
-Email: lwvrbanac@gmail.com
----------------------------------
-'''
-import socket
-
-HOST = '127.0.0.1'
-HOST_SOCKET = 37200
-BUFFER = 4096
-TIMEOUT = 0.5
-
-def client_main():
-  #AF_INET is for 32-bit addresses like 0.0.0.0 and SOCK_STREAM is for setting up the tcp protocol
-  client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-
-  #connect to server and let user know of success
-  client.connect((HOST, HOST_SOCKET))
-  print("Initial Connection successful:\n")
-
-  #recieve initial data and relay to CLI upon success
-  client_data = client.recv(BUFFER)
-  client_number = client_data.decode("utf-8", errors="replace")
-  print(f"{client_number}\n")
-
-  if client_number.startswith("BUSY"):
-     return
-
-  #echo to server to acknowledge opening of connection
-  client.send(client_data)
-
-  #basic instructions for client side and initialization for input loop
-  print("send a string to the server\nType 'exit' to close the client or 'status' for cache data\nType 'list' to get the repo of all files\nType the name of the file to be streamed to the client to access it")
-  input_string = "temp"
-  
-  #input loop
-  while input_string:
-    input_string  = input("Enter message here: ")
-    #necessary for the server to tell the message has ended, not handled automatically by CLI
-    input_string += "\n"
-
-    #send CLI command or message to server
-    client.send(input_string.encode("utf-8", errors="replace"))
-
-    #recieve and print message
-    data_string = recieve_data(client)
-    print(f"data recieved from server: {data_string}\n")
-
-    #if the 'exit' command is issued break the loop and close the client
-    if input_string == "exit\n" or input_string == "Exit\n":
-      break
-  
-  client.close()
-
-#modified copy of reception method from server
-def recieve_data(client):
-   #sets timeout for incoming data and reads byte by byte into bytearray
-   client.settimeout(TIMEOUT)
-   incoming = bytearray()
-
-   #loops while data incoming
-   while True:
-      try:
-         
-         #recieves byte of data
-         data = client.recv(1)
-
-         #checks if connection closed, useful if sent data is "exit" otherwise timeout does not occur
-         if data == b"":
-            return incoming.decode()
-         
-         #puts read byte of data into bytearray
-         incoming.extend(data)
-
-      #breaks loop when no more data incoming
-      except socket.timeout:
-         break
-    #returns data in human legible form
-   return incoming.decode()
-
-#runs the program  
-if __name__ == "__main__":
-    client_main()
\ No newline at end of file
+'''
+---------------------------------
+Client For Socket Programming
+---------------------------------
+__updated__ = '2025-10-20'
+Author: Luke Vrbanac,
+Email: lwvrbanac@gmail.com
+---------------------------------
+'''
+import selectors
+import socket
+import sys
+
+HOST = '127.0.0.1'
+HOST_SOCKET = 37200
+BUFFER = 65536  #preallocated receive buffer size
+
+#frames every message as a 4-byte big-endian length prefix + payload,
+#matching the server's wire format, no delimiter scanning needed
+def send_msg(sock, payload):
+  sock.sendall(len(payload).to_bytes(4, "big") + payload)
+
+#buffered reader over one preallocated bytearray, the kernel writes
+#straight into it via recv_into so no per-chunk bytes objects are made
+#the buffer must stay a bytearray: it is the one allocation the reader
+#ever makes, swapping in bytes would bring back a copy per recv
+class MsgReader:
+  def __init__(self, sock):
+    self.sock = sock
+    self.buf: bytearray = bytearray(BUFFER)
+    self.view = memoryview(self.buf)
+    self.start = 0  #consumed prefix, everything before this was handed out
+    self.pos = 0    #bytes filled, recv_into appends from here
+
+  #compacts consumed bytes to the front and recvs into the free tail
+  #returns False when the connection is closed
+  def _fill(self):
+    if self.start:
+      remaining = self.pos - self.start
+      self.view[:remaining] = self.view[self.start:self.pos]
+      self.start = 0
+      self.pos = remaining
+    if self.pos == len(self.buf):
+      #a single message outgrew the buffer, double it (view must be
+      #released first, a bytearray with an exported view cannot resize)
+      self.view.release()
+      self.buf.extend(bytes(len(self.buf)))
+      self.view = memoryview(self.buf)
+    n = self.sock.recv_into(self.view[self.pos:])
+    if n == 0:
+      return False
+    self.pos += n
+    return True
+
+  #True when a complete message is already buffered, lets the selector
+  #loop drain every response one recv pulled in before selecting again
+  def pending(self):
+    avail = self.pos - self.start
+    if avail < 4:
+      return False
+    length = int.from_bytes(self.view[self.start:self.start + 4], "big")
+    return avail >= 4 + length
+
+  #reads one length-prefixed message, returns b"" on disconnect
+  def read_msg(self):
+    header = self.readexact(4)
+    if len(header) < 4:
+      #connection closed mid-header
+      return b""
+    return self.readexact(int.from_bytes(header, "big"))
+
+  #reads exactly n bytes, used for the prefix header and file payloads
+  def readexact(self, n):
+    out = bytearray()
+    while n > 0:
+      if self.start == self.pos and not self._fill():
+        break
+      take = min(self.pos - self.start, n)
+      out += self.view[self.start:self.start + take]
+      self.start += take
+      if self.start == self.pos:
+        self.start = self.pos = 0
+      n -= take
+    return bytes(out)
+
+def client_main():
+  #AF_INET is for 32-bit addresses like 0.0.0.0 and SOCK_STREAM is for setting up the tcp protocol
+  client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+
+  #connect to server and let user know of success
+  client.connect((HOST, HOST_SOCKET))
+  print("Initial Connection successful:\n")
+
+  #disable Nagle so small commands go out immediately, and widen the
+  #socket buffers so file downloads aren't throttled by the defaults
+  client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+  client.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4 * 1024 * 1024)
+  client.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+
+  #buffered reader for everything the server sends back
+  reader = MsgReader(client)
+
+  #recieve initial data and relay to CLI upon success
+  client_data = reader.read_msg()
+  client_number = client_data.decode("utf-8", errors="replace")
+  print(f"{client_number}\n")
+
+  if client_number.startswith("BUSY"):
+     return
+
+  #echo to server to acknowledge opening of connection
+  send_msg(client, client_data)
+
+  #basic instructions for client side and initialization for input loop
+  print("send a string to the server\nType 'exit' to close the client or 'status' for cache data\nType 'list' to get the repo of all files\nType the name of the file to be streamed to the client to access it")
+
+  #input loop, a selector multiplexes stdin and the socket so several
+  #commands can be typed (pipelined) without waiting on each response
+  sel = selectors.DefaultSelector()
+  sel.register(sys.stdin, selectors.EVENT_READ)
+  sel.register(client, selectors.EVENT_READ)
+  stdin_open = True
+  exiting = False
+  done = False
+
+  sys.stdout.write("Enter message here: ")
+  sys.stdout.flush()
+
+  while not done:
+    for key, _ in sel.select():
+      if key.fileobj is sys.stdin:
+        input_string = sys.stdin.readline()
+        if not input_string:
+          #stdin closed, tell the server we are leaving
+          input_string = "exit"
+        else:
+          #the length prefix frames the message, no newline needed
+          input_string = input_string.rstrip("\n")
+
+        #send CLI command or message to server as one framed message
+        send_msg(client, input_string.encode("utf-8", errors="replace"))
+
+        #if the 'exit' command is issued stop reading input, the loop
+        #ends once the server's goodbye has been printed
+        if input_string.casefold() == "exit":
+          exiting = True
+          if stdin_open:
+            sel.unregister(sys.stdin)
+            stdin_open = False
+
+      else:
+        #recieve and print every response already buffered, one recv can
+        #pull in several replies when commands were pipelined
+        while True:
+          data_string = recieve_data(reader)
+          print(f"data recieved from server: {data_string}\n")
+          if data_string == "" or (exiting and data_string == "BYE"):
+            done = True
+            break
+          if not reader.pending():
+            break
+        if not done:
+          sys.stdout.write("Enter message here: ")
+          sys.stdout.flush()
+
+  sel.close()
+  client.close()
+
+#reads one full server response, every message is length-prefixed so a
+#multi-line status report arrives whole and needs no marker scanning
+def recieve_data(reader):
+   msg = reader.read_msg().decode("utf-8", errors="replace")
+
+   #file transfers are a FILESIZE message, the raw bytes, then FILEEND
+   if msg.startswith("FILESIZE "):
+      try:
+         size = int(msg.split(" ", 1)[1])
+      except ValueError:
+         return msg
+      body = reader.readexact(size)
+      reader.read_msg()  #consume the FILEEND terminator
+      return body.decode("utf-8", errors="replace")
+
+   #everything else is a single message
+   return msg
+
+#runs the program
+if __name__ == "__main__":
+    client_main()